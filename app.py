@@ -1,7 +1,9 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, session
-from datetime import datetime, timedelta
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, session, g
+from flask.json.provider import DefaultJSONProvider
+from markupsafe import escape
+from datetime import datetime
 import os
-import json
+import orjson
 import csv
 from io import StringIO
 import smtplib
@@ -9,14 +11,59 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import secrets
 import hashlib
+import hmac
+import base64
 import uuid
+import urllib.parse
 import re
+import math
+import string
 import threading
 import time
 import queue
-import traceback
+import heapq
+import bisect
+from collections import defaultdict
+from operator import itemgetter
+from itertools import islice
+import logging
+import copy
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process locks only
+    fcntl = None
+import functools
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Serve jsonify() through orjson, keeping Flask's fallbacks for other types"""
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        # orjson has no hooks; the session serializer needs object_hook to untag values
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+logger = logging.getLogger(__name__)
+# Errors and warnings only by default; LOG_LEVEL=INFO brings back the email
+# progress messages. Only this module's logger is configured, so the host's
+# (and werkzeug's request log) setup is left alone
+_log_level = os.environ.get('LOG_LEVEL', 'WARNING').upper()
+logger.setLevel(logging.getLevelNamesMapping().get(_log_level, logging.WARNING))
+if not logger.handlers and not logging.getLogger().handlers:
+    # Nothing configured root logging; without a handler INFO would be dropped
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logger.addHandler(_log_handler)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+# Responses are read by scripts, not diffed; skip the per-response key sort
+app.json.sort_keys = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-12345')
 
 # Email configuration
@@ -26,6 +73,10 @@ app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME', '')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD', '')
 app.config['MAIL_USE_TLS'] = True
 
+# Debug and admin helpers (user lists, manual verification, test email) are
+# unauthenticated, so they are only routed when explicitly switched on
+app.config['ENABLE_DEBUG_ROUTES'] = os.environ.get('ENABLE_DEBUG_ROUTES', '').lower() in ('1', 'true', 'yes')
+
 # Simple file-based storage for persistence
 DATA_FILE = 'data.json'
 USERS_FILE = 'users.json'
@@ -34,10 +85,185 @@ USERS_FILE = 'users.json'
 email_queue = queue.Queue()
 email_worker_started = False
 
+class StoreLoadError(Exception):
+    """A store file exists but couldn't be read; nothing may be saved over it"""
+
+# Parsed data.json kept in memory, keyed on the file's stat signature
+_DATA_CACHE = {'version': None, 'data': None}
+_DATA_LOCK = threading.RLock()
+
+# Parsed users.json, cached the same way as data.json
+_USERS_CACHE = {'version': None, 'data': None}
+_USERS_LOCK = threading.RLock()
+
+# Rendered homepage per user: user_id -> (data signature, (user name, html))
+_INDEX_CACHE = {}
+
+# Settle-up results per group: group_id -> (data signature, (balances, settlements))
+_SETTLE_CACHE = {}
+_RENDER_CACHE_LOCK = threading.Lock()
+
+def _cache_store(cache, key, data_version, payload):
+    """Cache a result for the current data.json, evicting entries from older versions"""
+    with _RENDER_CACHE_LOCK:
+        for stale_key in [k for k, (version, _) in cache.items() if version != data_version]:
+            del cache[stale_key]
+        cache[key] = (data_version, payload)
+
+# Rendered pages with no per-user content: (template, context items) -> html
+_PAGE_CACHE = {}
+
+# Expense rows written per chunk of a streamed CSV export
+CSV_BATCH_ROWS = 200
+
+# One comma-separated member name, surrounding whitespace excluded
+_MEMBER_RE = re.compile(r'[^,\s](?:[^,]*[^,\s])?')
+
 # ========== EMAIL FUNCTIONS ==========
 
+# Email bodies, parsed once; $username (HTML-escaped) and $link are filled per send
+VERIFICATION_EMAIL_TEMPLATE = string.Template("""\
+<html>
+<body style="font-family: Arial, sans-serif; line-height: 1.6;">
+    <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
+        <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; text-align: center; border-radius: 10px 10px 0 0;">
+            <h1>Friendz Share</h1>
+            <p>Share Expenses. Strengthen Friendships.</p>
+        </div>
+        <div style="background: #f9f9f9; padding: 20px; border-radius: 0 0 10px 10px;">
+            <h2>Welcome, ${username}!</h2>
+            <p>Thank you for registering with Friendz Share. To start sharing expenses with your friends, please verify your email address by clicking the button below:</p>
+            
+            <div style="text-align: center; margin: 30px 0;">
+                <a href="${link}" style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 12px 30px; text-decoration: none; border-radius: 25px; display: inline-block;">
+                    Verify Email Address
+                </a>
+            </div>
+            
+            <p>If the button doesn't work, copy and paste this link in your browser:</p>
+            <p style="word-break: break-all; color: #667eea; background: #f0f0f0; padding: 10px; border-radius: 5px;">
+                ${link}
+            </p>
+            
+            <p>This link will expire in 24 hours for security reasons.</p>
+            
+            <p>Happy sharing!<br>The Friendz Share Team</p>
+        </div>
+    </div>
+</body>
+</html>
+""")
+
+PASSWORD_RESET_EMAIL_TEMPLATE = string.Template("""\
+<!DOCTYPE html>
+<html>
+<head>
+    <style>
+        body { font-family: Arial, sans-serif; }
+        .container { max-width: 600px; margin: 0 auto; padding: 20px; }
+        .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
+                 color: white; padding: 20px; text-align: center; border-radius: 10px 10px 0 0; }
+        .content { background: #f9f9f9; padding: 20px; border-radius: 0 0 10px 10px; }
+        .button { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
+                 color: white; padding: 12px 30px; text-decoration: none; 
+                 border-radius: 25px; display: inline-block; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>Friendz Share</h1>
+            <p>Password Reset Request</p>
+        </div>
+        <div class="content">
+            <h2>Hello, ${username}!</h2>
+            <p>We received a request to reset your password. Click the button below to create a new password:</p>
+            
+            <div style="text-align: center; margin: 30px 0;">
+                <a href="${link}" class="button">Reset Password</a>
+            </div>
+            
+            <p>If the button doesn't work, copy and paste this link in your browser:</p>
+            <p style="word-break: break-all; color: #667eea;">${link}</p>
+            
+            <p>This link will expire in 1 hour for security reasons.</p>
+            
+            <p>If you didn't request a password reset, please ignore this email.</p>
+            
+            <p>Best regards,<br>The Friendz Share Team</p>
+        </div>
+    </div>
+</body>
+</html>
+""")
+
+# Authenticated SMTP connection per sending thread, reused between emails
+_smtp_local = threading.local()
+
+def _get_smtp(timeout=15):
+    """Return this thread's SMTP connection, reconnecting if it was dropped"""
+    key = (app.config['MAIL_SERVER'], app.config['MAIL_PORT'], app.config['MAIL_USERNAME'])
+    server = getattr(_smtp_local, 'conn', None)
+    if server is not None and _smtp_local.key == key:
+        try:
+            if server.noop()[0] == 250:
+                return server
+        except (smtplib.SMTPException, OSError):
+            pass
+    _close_smtp()
+    
+    server = smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT'], timeout=timeout)
+    try:
+        server.starttls()
+        server.login(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
+    except BaseException:
+        # Connected but never handed out: close the socket here
+        server.close()
+        raise
+    _smtp_local.conn = server
+    _smtp_local.key = key
+    return server
+
+def _close_smtp():
+    """Drop this thread's SMTP connection, if any"""
+    server = getattr(_smtp_local, 'conn', None)
+    _smtp_local.conn = None
+    if server is not None:
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+def _send_smtp_message(msg, timeout):
+    """Send one message over SMTP.
+
+    The email worker reuses its thread's connection (TLS + login only on
+    the first send) and closes it when idle. Other threads, like request
+    threads calling the senders directly, get a connection for this send
+    only, so they never leave a socket open.
+    """
+    if not getattr(_smtp_local, 'reuse', False):
+        with smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT'], timeout=timeout) as server:
+            server.starttls()
+            server.login(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
+            server.send_message(msg)
+        return
+    try:
+        _get_smtp(timeout=timeout).send_message(msg)
+    except BaseException:
+        # Don't keep a connection in an unknown state for the next send
+        _close_smtp()
+        raise
+
+def _mask_email(email):
+    """Shorten an address for logs; full addresses are never logged"""
+    local, _, domain = str(email).partition('@')
+    return f"{local[:1]}***@{domain}"
+
 def email_worker():
     """Background worker to process emails from queue"""
+    # Only this thread keeps its SMTP connection between sends
+    _smtp_local.reuse = True
     while True:
         try:
             # Get email task from queue (with timeout to allow graceful shutdown)
@@ -46,7 +272,7 @@ def email_worker():
                 break
                 
             email_type, email, token, username = task
-            print(f"📧 Processing {email_type} email for {username} ({email})")
+            logger.info("Processing %s email for %s", email_type, _mask_email(email))
             
             if email_type == 'verification':
                 _send_verification_email_sync(email, token, username)
@@ -54,12 +280,14 @@ def email_worker():
                 _send_password_reset_email_sync(email, token, username)
                 
             email_queue.task_done()
-            print(f"✅ {email_type} email processed for {email}")
+            logger.info("%s email processed for %s", email_type, _mask_email(email))
             
         except queue.Empty:
+            # Idle: don't hold the SMTP connection open until the server drops it
+            _close_smtp()
             continue
-        except Exception as e:
-            print(f"❌ Email worker error: {e}")
+        except Exception:
+            logger.exception("Email worker error")
             continue
 
 def start_email_worker():
@@ -69,59 +297,26 @@ def start_email_worker():
         worker_thread = threading.Thread(target=email_worker, daemon=True)
         worker_thread.start()
         email_worker_started = True
-        print("✅ Email worker started")
+        logger.info("Email worker started")
 
 def _send_verification_email_sync(email, verification_token, username):
     """Synchronous email sending (called from background worker)"""
     try:
         # Check if email is configured
         if not app.config['MAIL_USERNAME'] or not app.config['MAIL_PASSWORD']:
-            print("❌ Email credentials not configured")
-            print(f"   MAIL_USERNAME: {'Set' if app.config['MAIL_USERNAME'] else 'Not set'}")
-            print(f"   MAIL_PASSWORD: {'Set' if app.config['MAIL_PASSWORD'] else 'Not set'}")
             verification_link = f"https://settle-up-app.onrender.com/verify_email/{verification_token}"
-            print(f"📧 MANUAL VERIFICATION LINK: {verification_link}")
+            logger.warning("Email credentials not configured (MAIL_USERNAME %s, MAIL_PASSWORD %s); "
+                           "manual verification link: %s",
+                           'set' if app.config['MAIL_USERNAME'] else 'not set',
+                           'set' if app.config['MAIL_PASSWORD'] else 'not set',
+                           verification_link)
             return False
             
-        print(f"🔧 Starting email send to: {email}")
-        print(f"🔧 Using SMTP: {app.config['MAIL_SERVER']}:{app.config['MAIL_PORT']}")
-        print(f"🔧 From: {app.config['MAIL_USERNAME']}")
-        
         verification_link = f"https://settle-up-app.onrender.com/verify_email/{verification_token}"
         subject = "Verify Your Friendz Share Account"
         
         # Simple HTML email (more compatible)
-        html_content = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; text-align: center; border-radius: 10px 10px 0 0;">
-                    <h1>Friendz Share</h1>
-                    <p>Share Expenses. Strengthen Friendships.</p>
-                </div>
-                <div style="background: #f9f9f9; padding: 20px; border-radius: 0 0 10px 10px;">
-                    <h2>Welcome, {username}!</h2>
-                    <p>Thank you for registering with Friendz Share. To start sharing expenses with your friends, please verify your email address by clicking the button below:</p>
-                    
-                    <div style="text-align: center; margin: 30px 0;">
-                        <a href="{verification_link}" style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 12px 30px; text-decoration: none; border-radius: 25px; display: inline-block;">
-                            Verify Email Address
-                        </a>
-                    </div>
-                    
-                    <p>If the button doesn't work, copy and paste this link in your browser:</p>
-                    <p style="word-break: break-all; color: #667eea; background: #f0f0f0; padding: 10px; border-radius: 5px;">
-                        {verification_link}
-                    </p>
-                    
-                    <p>This link will expire in 24 hours for security reasons.</p>
-                    
-                    <p>Happy sharing!<br>The Friendz Share Team</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        html_content = VERIFICATION_EMAIL_TEMPLATE.substitute(username=escape(username), link=verification_link)
         
         # Create message
         msg = MIMEMultipart()
@@ -132,106 +327,45 @@ def _send_verification_email_sync(email, verification_token, username):
         # Add HTML content
         msg.attach(MIMEText(html_content, 'html'))
         
-        print(f"🔧 Attempting SMTP connection to {app.config['MAIL_SERVER']}:{app.config['MAIL_PORT']}...")
-        
-        # Create SMTP connection with timeout
-        server = smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT'], timeout=15)
-        
-        print("🔧 Starting TLS...")
-        server.starttls()
-        
-        print("🔧 Attempting login...")
-        server.login(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-        
-        print("🔧 Sending email message...")
-        server.send_message(msg)
-        
-        print("🔧 Closing connection...")
-        server.quit()
+        _send_smtp_message(msg, timeout=15)
         
-        print(f"✅ Verification email sent successfully to {email}")
+        logger.info("Verification email sent to %s", _mask_email(email))
         return True
         
     except smtplib.SMTPAuthenticationError as e:
-        print(f"❌ SMTP AUTHENTICATION ERROR: {e}")
-        print("💡 Common solutions:")
-        print("   1. Make sure you're using an App Password, not your regular Outlook password")
-        print("   2. Enable 2-factor authentication in your Microsoft account")
-        print("   3. Generate a new App Password specifically for this app")
+        logger.error("SMTP authentication failed: %s (use an App Password with 2-factor "
+                     "authentication enabled, not the regular account password)", e)
         return False
         
     except smtplib.SMTPConnectError as e:
-        print(f"❌ SMTP CONNECTION ERROR: {e}")
-        print("💡 Check your MAIL_SERVER and MAIL_PORT settings")
+        logger.error("SMTP connection to %s:%s failed: %s",
+                     app.config['MAIL_SERVER'], app.config['MAIL_PORT'], e)
         return False
         
     except smtplib.SMTPServerDisconnected as e:
-        print(f"❌ SMTP SERVER DISCONNECTED: {e}")
+        logger.error("SMTP server disconnected: %s", e)
         return False
         
     except smtplib.SMTPException as e:
-        print(f"❌ SMTP ERROR: {e}")
+        logger.error("SMTP error: %s", e)
         return False
         
-    except Exception as e:
-        print(f"❌ UNEXPECTED ERROR: {str(e)}")
-        print(f"💡 Error type: {type(e).__name__}")
-        print(f"💡 Traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Unexpected error sending verification email to %s", _mask_email(email))
         return False
 
 def _send_password_reset_email_sync(email, reset_token, username):
     """Synchronous password reset email (called from background worker)"""
     try:
         if not app.config['MAIL_USERNAME'] or not app.config['MAIL_PASSWORD']:
-            print("❌ Email credentials not configured for password reset")
+            logger.warning("Email credentials not configured for password reset")
             return False
             
         reset_link = f"https://settle-up-app.onrender.com/reset_password/{reset_token}"
         
         subject = "Reset Your Friendz Share Password"
         
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
-                         color: white; padding: 20px; text-align: center; border-radius: 10px 10px 0 0; }}
-                .content {{ background: #f9f9f9; padding: 20px; border-radius: 0 0 10px 10px; }}
-                .button {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
-                         color: white; padding: 12px 30px; text-decoration: none; 
-                         border-radius: 25px; display: inline-block; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>Friendz Share</h1>
-                    <p>Password Reset Request</p>
-                </div>
-                <div class="content">
-                    <h2>Hello, {username}!</h2>
-                    <p>We received a request to reset your password. Click the button below to create a new password:</p>
-                    
-                    <div style="text-align: center; margin: 30px 0;">
-                        <a href="{reset_link}" class="button">Reset Password</a>
-                    </div>
-                    
-                    <p>If the button doesn't work, copy and paste this link in your browser:</p>
-                    <p style="word-break: break-all; color: #667eea;">{reset_link}</p>
-                    
-                    <p>This link will expire in 1 hour for security reasons.</p>
-                    
-                    <p>If you didn't request a password reset, please ignore this email.</p>
-                    
-                    <p>Best regards,<br>The Friendz Share Team</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        html_content = PASSWORD_RESET_EMAIL_TEMPLATE.substitute(username=escape(username), link=reset_link)
         
         msg = MIMEMultipart()
         msg['From'] = app.config['MAIL_USERNAME']
@@ -239,17 +373,13 @@ def _send_password_reset_email_sync(email, reset_token, username):
         msg['Subject'] = subject
         msg.attach(MIMEText(html_content, 'html'))
         
-        server = smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT'], timeout=10)
-        server.starttls()
-        server.login(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-        server.send_message(msg)
-        server.quit()
+        _send_smtp_message(msg, timeout=10)
         
-        print(f"✅ Password reset email sent to {email}")
+        logger.info("Password reset email sent to %s", _mask_email(email))
         return True
         
-    except Exception as e:
-        print(f"❌ Password reset email error: {e}")
+    except Exception:
+        logger.exception("Password reset email to %s failed", _mask_email(email))
         return False
 
 def queue_verification_email(email, verification_token, username):
@@ -257,10 +387,10 @@ def queue_verification_email(email, verification_token, username):
     try:
         start_email_worker()  # Ensure worker is running
         email_queue.put(('verification', email, verification_token, username))
-        print(f"📧 Verification email queued for {email}")
+        logger.info("Verification email queued for %s", _mask_email(email))
         return True
-    except Exception as e:
-        print(f"❌ Failed to queue verification email: {e}")
+    except Exception:
+        logger.exception("Failed to queue verification email")
         return False
 
 def queue_password_reset_email(email, reset_token, username):
@@ -268,15 +398,23 @@ def queue_password_reset_email(email, reset_token, username):
     try:
         start_email_worker()  # Ensure worker is running
         email_queue.put(('password_reset', email, reset_token, username))
-        print(f"📧 Password reset email queued for {email}")
+        logger.info("Password reset email queued for %s", _mask_email(email))
         return True
-    except Exception as e:
-        print(f"❌ Failed to queue password reset email: {e}")
+    except Exception:
+        logger.exception("Failed to queue password reset email")
         return False
 
 # ========== DEBUG ROUTES ==========
 
-@app.route('/debug/email_queue')
+def debug_route(rule, **options):
+    """Like app.route(), but only registers the view when ENABLE_DEBUG_ROUTES is set"""
+    def decorator(view):
+        if app.config['ENABLE_DEBUG_ROUTES']:
+            app.add_url_rule(rule, view_func=view, **options)
+        return view
+    return decorator
+
+@debug_route('/debug/email_queue')
 def debug_email_queue():
     """Show current email queue status"""
     queue_info = {
@@ -292,9 +430,10 @@ def debug_email_queue():
     }
     return jsonify(queue_info)
 
-@app.route('/debug/email_status')
+@debug_route('/debug/email_status')
 def debug_email_status():
     """Check email configuration and queue status"""
+    users = load_users()['users']
     status = {
         'email_configured': bool(app.config['MAIL_USERNAME'] and app.config['MAIL_PASSWORD']),
         'mail_server': app.config['MAIL_SERVER'],
@@ -304,12 +443,16 @@ def debug_email_status():
         'mail_use_tls': app.config['MAIL_USE_TLS'],
         'queue_size': email_queue.qsize(),
         'worker_started': email_worker_started,
-        'total_users': len(load_users().get('users', {})),
-        'unverified_users': sum(1 for user in load_users().get('users', {}).values() if not user.get('verified', False))
+        'total_users': len(users),
+        'unverified_users': sum(1 for user in users.values() if not user.get('verified', False))
     }
-    return jsonify(status)
+    response = jsonify(status)
+    # Monitoring may poll this; let the client reuse it briefly
+    response.cache_control.private = True
+    response.cache_control.max_age = 5
+    return response
 
-@app.route('/debug/env')
+@debug_route('/debug/env')
 def debug_env():
     """Check environment variables (safe version)"""
     env_vars = {
@@ -323,14 +466,14 @@ def debug_env():
     }
     return jsonify(env_vars)
 
-@app.route('/test_email')
+@debug_route('/test_email')
 def test_email():
     """Test email sending functionality"""
     test_email_address = "test@example.com"  # Change this to your actual email
     test_token = "test-verification-token-123"
     test_username = "Test User"
     
-    print(f"🧪 Starting email test to: {test_email_address}")
+    logger.info("Starting email test to %s", _mask_email(test_email_address))
     
     # Test direct email sending (not queued)
     try:
@@ -357,10 +500,10 @@ def test_email():
             'error_type': type(e).__name__
         })
 
-@app.route('/manual_verify/<email>')
+@debug_route('/manual_verify/<email>')
 def manual_verify(email):
     """Manually verify a user's email"""
-    users_data = load_users()
+    users_data = load_users(for_update=True)
     user = users_data['users'].get(email.lower())
     
     if not user:
@@ -383,10 +526,10 @@ def manual_verify(email):
     else:
         return jsonify({'error': 'Failed to save user data'})
 
-@app.route('/admin/verify_all')
+@debug_route('/admin/verify_all')
 def verify_all_users():
     """Verify all unverified users (for testing)"""
-    users_data = load_users()
+    users_data = load_users(for_update=True)
     verified_count = 0
     
     for email, user in users_data['users'].items():
@@ -395,7 +538,7 @@ def verify_all_users():
             if 'verification_token' in user:
                 user.pop('verification_token')
             verified_count += 1
-            print(f"✅ Verified user: {email}")
+            logger.info("Verified user %s", _mask_email(email))
     
     if save_users(users_data):
         return jsonify({
@@ -409,7 +552,7 @@ def verify_all_users():
             'message': 'Failed to save users'
         })
 
-@app.route('/admin/users')
+@debug_route('/admin/users')
 def admin_users():
     """Admin view of all users"""
     users_data = load_users()
@@ -433,148 +576,488 @@ def admin_users():
 
 # ========== CORE FUNCTIONS ==========
 
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
 def is_valid_email(email):
     """Validate email format"""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+    return _EMAIL_RE.match(email) is not None
+
+def hash_token(token):
+    """Digest of an emailed token as stored in users.json ('sha256$hex').
+
+    Tokens are single-use links, already random, so one SHA-256 round is
+    enough to keep a leaked users file from handing out working links.
+    """
+    return 'sha256$' + hashlib.sha256(token.encode()).hexdigest()
 
-def load_users():
-    """Load users data from file"""
+def _stored_token_key(stored_token):
+    """Index key for a stored token; older files hold the raw token"""
+    return stored_token if stored_token.startswith('sha256$') else hash_token(stored_token)
+
+def _index_user_tokens(data):
+    """Map pending verification and reset token digests to users' emails.
+
+    Kept under underscore keys, which save_users() doesn't store, and
+    rebuilt on every load and save so token links resolve in O(1). Look up
+    a link's token with hash_token(token).
+    """
+    users = data['users']
+    data['_by_verification_token'] = {_stored_token_key(user['verification_token']): email
+                                      for email, user in users.items() if user.get('verification_token')}
+    data['_by_reset_token'] = {_stored_token_key(user['reset_token']): email
+                               for email, user in users.items() if user.get('reset_token')}
+    return data
+
+def users_file_signature():
+    """Identify the current users.json version, or None if it doesn't exist"""
     try:
-        if not os.path.exists(USERS_FILE):
-            default_data = {'users': {}}
-            with open(USERS_FILE, 'w') as f:
-                json.dump(default_data, f, indent=2)
-            return default_data
-        
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error loading users: {e}")
-        return {'users': {}}
+        st = os.stat(USERS_FILE)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def load_users(for_update=False):
+    """Load users data from file.
+
+    Reads share the cached dict while users.json is unchanged and must not
+    modify it. Pass for_update=True before changing a user: like
+    get_data(for_update=True), the request then holds the users lock until
+    it ends and works on its own copy. An unreadable users.json raises
+    StoreLoadError for writers instead of giving them an empty store.
+    """
+    if for_update and not g.get('users_for_update'):
+        _USERS_LOCK.acquire()
+        try:
+            g.users_lock_fd = _lock_file(USERS_FILE)
+        except OSError:
+            # Teardown only releases locks it knows were taken
+            _USERS_LOCK.release()
+            raise
+        g.users_for_update = True
+    try:
+        with _USERS_LOCK:
+            version = users_file_signature()
+            if version is None:
+                # Reads never write; the first save_users() creates the file
+                data = _index_user_tokens({'users': {}})
+            elif version == _USERS_CACHE['version']:
+                data = _USERS_CACHE['data']
+            else:
+                with open(USERS_FILE, 'rb') as f:
+                    data = orjson.loads(f.read())
+                data.setdefault('users', {})
+                _index_user_tokens(data)
+                _USERS_CACHE['version'] = version
+                _USERS_CACHE['data'] = data
+            return copy.deepcopy(data) if for_update else data
+    except (OSError, orjson.JSONDecodeError, AttributeError, TypeError, KeyError) as e:
+        logger.exception("Error loading users")
+        if for_update:
+            # Saving the empty fallback would delete every existing account
+            raise StoreLoadError(USERS_FILE) from e
+        return _index_user_tokens({'users': {}})
 
 def save_users(data):
     """Save users data to file"""
     try:
-        with open(USERS_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
+        stored = {key: value for key, value in data.items() if not key.startswith('_')}
+        with _USERS_LOCK:
+            # Same temp-file-and-rename write as save_data(), so a crash
+            # mid-write can't leave a truncated users.json
+            tmp_file = f"{USERS_FILE}.tmp.{os.getpid()}"
+            with open(tmp_file, 'wb') as f:
+                # One serialized blob, same two-space layout json.dump() wrote
+                f.write(orjson.dumps(stored, default=str, option=orjson.OPT_INDENT_2))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, USERS_FILE)
+            _index_user_tokens(data)
+            # The writer's copy becomes the shared cached version
+            _USERS_CACHE['version'] = users_file_signature()
+            _USERS_CACHE['data'] = data
         return True
     except Exception as e:
-        print(f"Error saving users: {e}")
+        _USERS_CACHE['version'] = None
+        logger.exception("Error saving users")
         return False
 
+# scrypt cost parameters for new hashes; stored hashes carry their own
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+
 def hash_password(password):
-    """Hash password using SHA-256 with salt"""
-    salt = secrets.token_hex(16)
-    return hashlib.sha256((password + salt).encode()).hexdigest() + ':' + salt
+    """Hash password with scrypt as 'scrypt$n$r$p$salt$hash' (base64 salt and hash)"""
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=32)
+    return (f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$"
+            f"{base64.b64encode(salt).decode()}${base64.b64encode(digest).decode()}")
+
+@functools.lru_cache(maxsize=1024)
+def _parse_stored_hash(stored_password):
+    """Split a stored hash into (scrypt params or None, salt bytes, digest bytes)"""
+    if stored_password.startswith('scrypt$'):
+        _, n, r, p, salt, hashed = stored_password.split('$')
+        return (int(n), int(r), int(p)), base64.b64decode(salt), base64.b64decode(hashed)
+    hashed, salt = stored_password.split(':')
+    return None, salt.encode(), bytes.fromhex(hashed)
 
 def verify_password(stored_password, provided_password):
-    """Verify password against stored hash"""
+    """Verify password against stored hash (scrypt, or legacy 'sha256hex:salt')"""
     try:
-        hashed, salt = stored_password.split(':')
-        return hashlib.sha256((provided_password + salt).encode()).hexdigest() == hashed
-    except:
+        params, salt, expected = _parse_stored_hash(stored_password)
+        if params:
+            n, r, p = params
+            digest = hashlib.scrypt(provided_password.encode(), salt=salt, n=n, r=r, p=p, dklen=len(expected))
+        else:
+            digest = hashlib.sha256(provided_password.encode() + salt).digest()
+        return hmac.compare_digest(digest, expected)
+    except (ValueError, TypeError, AttributeError):
         return False
 
-def load_data():
-    """Load data from file with proper error handling"""
+def password_needs_rehash(stored_password):
+    """True for legacy SHA-256 hashes and scrypt hashes below the current cost"""
     try:
-        if not os.path.exists(DATA_FILE):
-            default_data = {
-                'groups': {},
-                'expenses': {},
-                'next_group_id': 1,
-                'next_expense_id': 1,
-                'recent_members': []
+        return _parse_stored_hash(stored_password)[0] != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    except (ValueError, TypeError, AttributeError):
+        return True
+
+# Verified against when the email is unknown, so a login attempt takes the
+# same time whether or not the account exists
+_DUMMY_PASSWORD_HASH = hash_password(secrets.token_urlsafe(16))
+
+def _empty_data():
+    """Fresh data structure for an empty store"""
+    return {
+        'groups': {},
+        'expenses': {},
+        'next_group_id': 1,
+        'next_expense_id': 1,
+        'recent_members': [],
+        'recent_members_version': 0
+    }
+
+def _backfill_group_totals(data):
+    """Compute per-group totals for files written before they were stored"""
+    # Store-wide totals are no longer kept; index() sums the user's own groups
+    data.pop('totals', None)
+    for group_id, group in data['groups'].items():
+        if isinstance(group, dict) and 'total_spent' not in group:
+            group['total_spent'] = round(sum(
+                data['expenses'][exp_key].get('amount', 0)
+                for exp_key in data['_by_group'].get(group_id, [])
+            ), 2)
+    return data
+
+def _normalize_expenses(data):
+    """Fill in fields older expense records lack, once per load instead of per view"""
+    now_iso = datetime.now().isoformat()
+    for exp_key, expense in data['expenses'].items():
+        if not isinstance(expense, dict):
+            continue
+        try:
+            expense.setdefault('date', now_iso)
+            expense.setdefault('visit_date', expense['date'][:10])
+            expense.setdefault('base_amount', expense.get('amount', 0))
+            expense.setdefault('discount_amount', 0)
+            expense.setdefault('service_tax_amount', 0)
+            expense.setdefault('gst_amount', 0)
+            if 'participants' not in expense:
+                group = data['groups'].get(expense.get('group_id'), {})
+                expense['participants'] = group.get('members', [])
+            
+            # Stored by add_expense; only older records need formatting
+            if 'date_display' not in expense:
+                try:
+                    expense['date_display'] = datetime.fromisoformat(expense['date']).strftime('%Y-%m-%d %H:%M')
+                except (ValueError, TypeError):
+                    expense['date_display'] = "Unknown date"
+            expense.setdefault('visit_date_display', expense['visit_date'][:10])
+        except (TypeError, KeyError) as e:
+            logger.exception("Error normalizing expense %s", exp_key)
+    return data
+
+def _int_keys(records):
+    """Key a JSON object by int ID in memory; save_data() writes them back as strings"""
+    return {int(key) if key.isdigit() else key: value for key, value in records.items()}
+
+def _reconcile_counters(data):
+    """Move the ID counters past any IDs already in use.
+
+    Older files could fall behind their records; checking once per load
+    lets create_group() and add_expense() trust the counters.
+    """
+    for counter, records in (('next_group_id', data['groups']), ('next_expense_id', data['expenses'])):
+        used_ids = [key for key in records if isinstance(key, int)]
+        data[counter] = max(data[counter], max(used_ids, default=0) + 1)
+    return data
+
+def _iso_to_ns(iso_string):
+    """Epoch nanoseconds for an ISO timestamp, or 0 if it can't be parsed"""
+    try:
+        return int(datetime.fromisoformat(iso_string).timestamp() * 1_000_000_000)
+    except (ValueError, TypeError):
+        return 0
+
+def _backfill_timestamps(data):
+    """Add the numeric sort keys to records written before they were stored"""
+    for group in data['groups'].values():
+        if isinstance(group, dict) and 'created_at_ts' not in group:
+            group['created_at_ts'] = _iso_to_ns(group.get('created_at'))
+    for expense in data['expenses'].values():
+        if isinstance(expense, dict) and 'date_ts' not in expense:
+            expense['date_ts'] = _iso_to_ns(expense.get('date'))
+    return data
+
+def _normalize_groups(data):
+    """Fill in group fields that older files may lack, once per load.
+
+    Runs after _backfill_timestamps(), so a group without created_at still
+    sorts as oldest; it only gets a display timestamp here.
+    """
+    now_iso = datetime.now().isoformat()
+    for group_id, group in data['groups'].items():
+        if isinstance(group, dict):
+            group.setdefault('id', group_id if isinstance(group_id, int) else 0)
+            group.setdefault('members', [])
+            group.setdefault('created_at', now_iso)
+            group.setdefault('expenses', [])
+            # Older files stored the custom-split field names; they are
+            # derived from members, so drop them rather than trust them
+            group.pop('share_keys', None)
+    return data
+
+def _order_groups(data):
+    """Keep data['groups'] in creation order.
+
+    New groups are appended, so this only reorders files written out of
+    order; index() relies on it to list groups newest first.
+    """
+    stamps = [group.get('created_at_ts', 0) if isinstance(group, dict) else 0
+              for group in data['groups'].values()]
+    if any(earlier > later for earlier, later in zip(stamps, stamps[1:])):
+        data['groups'] = dict(sorted(
+            data['groups'].items(),
+            key=lambda item: item[1].get('created_at_ts', 0) if isinstance(item[1], dict) else 0
+        ))
+    return data
+
+def _backfill_balances(data):
+    """Compute the stored per-member balances (in cents) for older groups"""
+    for group_id, group in data['groups'].items():
+        if isinstance(group, dict) and 'balances' not in group:
+            group_expenses = [data['expenses'][exp_key] for exp_key in data['_by_group'].get(group_id, [])]
+            group['balances'] = {
+                member: _to_cents(balance)
+                for member, balance in calculate_balances(group.get('members', []), group_expenses).items()
             }
-            with open(DATA_FILE, 'w') as f:
-                json.dump(default_data, f, indent=2)
-            return default_data
-        
-        with open(DATA_FILE, 'r') as f:
-            data = json.load(f)
+    return data
+
+def _index_expenses(data):
+    """Normalize expense group IDs to int and bucket expense keys by group.
+
+    The '_by_group' index is derived state: it lives only in memory and is
+    stripped again by save_data().
+    """
+    by_group = defaultdict(list)
+    for exp_key, expense in data['expenses'].items():
+        if not isinstance(expense, dict):
+            continue
+        try:
+            expense['group_id'] = int(expense.get('group_id'))
+        except (ValueError, TypeError):
+            continue
+        by_group[expense['group_id']].append(exp_key)
+    data['_by_group'] = by_group
+    return data
+
+def _index_user_groups(data):
+    """Bucket group keys by the users who can see them, in creation order.
+
+    '_by_user' covers owners and shared_with users, so index() only walks
+    the current user's groups. Like '_by_group' it is never saved.
+    """
+    by_user = defaultdict(list)
+    for group_id, group in data['groups'].items():
+        if isinstance(group, dict):
+            for user_id in dict.fromkeys([group.get('owner_id')] + group.get('shared_with', [])):
+                by_user[user_id].append(group_id)
+    data['_by_user'] = by_user
+    return data
+
+def _index_share_tokens(data):
+    """Map each group's share token to its key for join_group(); never saved"""
+    data['_by_share_token'] = {group['share_token']: group_id for group_id, group in data['groups'].items()
+                               if isinstance(group, dict) and group.get('share_token')}
+    return data
+
+def data_file_signature():
+    """Identify the current data.json version, or None if it doesn't exist.
+
+    save_data() renames a fresh file into place, so the inode changes on
+    every write even when two writes land in the same mtime tick.
+    """
+    try:
+        st = os.stat(DATA_FILE)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def load_data(for_update=False):
+    """Load data from file with proper error handling.
+
+    Returns the shared cached dict while data.json is unchanged; callers
+    must not modify it (see get_data(for_update=True)). A file that can't
+    be read gives readers an empty store, but raises StoreLoadError for
+    writers, since saving that empty store would wipe every group.
+    """
+    try:
+        if not os.path.exists(DATA_FILE):
+            # Reads never write; the first save_data() creates the file
+            return _index_share_tokens(_index_user_groups(_index_expenses(_empty_data())))
+        
+        with _DATA_LOCK:
+            # Skip the parse entirely while the file is unchanged
+            version = data_file_signature()
+            if version == _DATA_CACHE['version']:
+                return _DATA_CACHE['data']
             
-        required_keys = ['groups', 'expenses', 'next_group_id', 'next_expense_id', 'recent_members']
-        for key in required_keys:
-            if key not in data:
-                if key == 'groups':
-                    data[key] = {}
-                elif key == 'expenses':
-                    data[key] = {}
-                elif key == 'recent_members':
-                    data[key] = []
-                else:
-                    data[key] = 1
-        
-        return data
-        
-    except (FileNotFoundError, json.JSONDecodeError, KeyError) as e:
-        print(f"Error loading data: {e}")
-        return {
-            'groups': {},
-            'expenses': {},
-            'next_group_id': 1,
-            'next_expense_id': 1,
-            'recent_members': []
-        }
+            with open(DATA_FILE, 'rb') as f:
+                data = orjson.loads(f.read())
+                
+            for key, default in (('groups', {}), ('expenses', {}), ('next_group_id', 1),
+                                 ('next_expense_id', 1), ('recent_members', []),
+                                 ('recent_members_version', 0)):
+                data.setdefault(key, default)
+            data['groups'] = _int_keys(data['groups'])
+            data['expenses'] = _int_keys(data['expenses'])
+            _reconcile_counters(data)
+            _index_expenses(data)
+            _normalize_expenses(data)
+            _backfill_group_totals(data)
+            _backfill_timestamps(data)
+            _normalize_groups(data)
+            _order_groups(data)
+            _index_user_groups(data)
+            _index_share_tokens(data)
+            _backfill_balances(data)
+            
+            _DATA_CACHE['version'] = version
+            _DATA_CACHE['data'] = data
+            return data
+        
+    except (FileNotFoundError, orjson.JSONDecodeError, KeyError) as e:
+        logger.exception("Error loading data")
+        if for_update:
+            raise StoreLoadError(DATA_FILE) from e
+        return _index_share_tokens(_index_user_groups(_index_expenses(_empty_data())))
 
 def save_data(data):
     """Save data to file with error handling"""
     try:
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data, f, indent=2, default=str)
+        # Underscore-prefixed keys are in-memory indexes, not stored data
+        stored = {key: value for key, value in data.items() if not key.startswith('_')}
+        with _DATA_LOCK:
+            # Write a temp file and rename it over data.json so readers never
+            # see a half-written file
+            tmp_file = f"{DATA_FILE}.tmp.{os.getpid()}"
+            with open(tmp_file, 'wb') as f:
+                # Compact output: the file is machine-read only, and indentation
+                # roughly doubled its size
+                f.write(orjson.dumps(stored, default=str, option=orjson.OPT_NON_STR_KEYS))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, DATA_FILE)
+            version = data_file_signature()
+            # The writer's private copy becomes the shared cached version
+            _DATA_CACHE['version'] = version
+            _DATA_CACHE['data'] = data
         return True
     except Exception as e:
-        print(f"Error saving data: {e}")
+        _DATA_CACHE['version'] = None
+        logger.exception("Error saving data")
         return False
 
-def get_next_group_id():
-    data = load_data()
-    next_id = data['next_group_id']
-    data['next_group_id'] += 1
-    if save_data(data):
-        return next_id
-    return None
+def _lock_file(path):
+    """Take an exclusive lock on path's sidecar .lock file; returns the fd.
 
-def get_next_expense_id():
-    data = load_data()
-    
-    # Find the maximum existing expense ID
-    existing_ids = []
-    for exp_id in data.get('expenses', {}).keys():
+    The in-process RLocks only serialize threads. This lock also covers
+    other worker processes, which share the files but not the locks.
+    """
+    fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is not None:
         try:
-            existing_ids.append(int(exp_id))
-        except (ValueError, TypeError):
-            continue
-    
-    # If no expenses exist, start from 1, else use max + 1
-    if existing_ids:
-        next_id = max(existing_ids) + 1
-    else:
-        next_id = 1
-    
-    # Update the next_expense_id counter
-    data['next_expense_id'] = next_id + 1
-    
-    if save_data(data):
-        return next_id
-    return None
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except OSError:
+            os.close(fd)
+            raise
+    return fd
 
-def update_recent_members(members_list):
-    data = load_data()
-    recent_members = data.get('recent_members', [])
-    
-    for member in members_list:
-        member_clean = member.strip()
-        if member_clean and member_clean not in recent_members:
-            # Remove if already exists to avoid duplicates
-            if member_clean in recent_members:
-                recent_members.remove(member_clean)
-            recent_members.insert(0, member_clean)
+def _unlock_file(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+def get_data(for_update=False):
+    """Load data once per request; later calls reuse the same dict.
+
+    Plain reads share the cached dict. Pass for_update=True before changing
+    anything: the request then holds the data lock (and data.json's file
+    lock) until it ends and works on its own copy, so an unsaved or failed
+    change never leaks into the cache other requests are reading.
+    """
+    if for_update and not g.get('data_for_update'):
+        _DATA_LOCK.acquire()
+        try:
+            g.data_lock_fd = _lock_file(DATA_FILE)
+        except OSError:
+            # Teardown only releases locks it knows were taken
+            _DATA_LOCK.release()
+            raise
+        g.data_for_update = True
+        # Loaded after locking, so another worker's last write is seen
+        g.data = copy.deepcopy(load_data(for_update=True))
+    elif 'data' not in g:
+        g.data = load_data()
+    return g.data
+
+@app.teardown_request
+def release_data_lock(exc):
+    if g.pop('data_for_update', False):
+        _unlock_file(g.pop('data_lock_fd'))
+        _DATA_LOCK.release()
+    if g.pop('users_for_update', False):
+        _unlock_file(g.pop('users_lock_fd'))
+        _USERS_LOCK.release()
+
+@app.errorhandler(StoreLoadError)
+def store_load_failed(e):
+    # Reached when a route lets the error through; either way nothing was saved
+    flash('Your data could not be loaded, so nothing was changed. Please try again later.', 'error')
+    return redirect(url_for('index'))
+
+def update_recent_members(data, members_list):
+    """Record members in data['recent_members']; the caller saves"""
+    # Most recent first: each new name goes in front of the ones before it,
+    # and dict.fromkeys drops the older copy of any repeated name in O(k + n)
+    added = [member.strip() for member in reversed(members_list) if member.strip()]
     
     # Keep only last 10 recent members
-    data['recent_members'] = recent_members[:10]
-    save_data(data)
+    data['recent_members'] = list(dict.fromkeys(added + data.get('recent_members', [])))[:10]
+    # Lets /api/recent_members answer repeat polls with 304 Not Modified
+    data['recent_members_version'] += 1
+
+# Amount fields of the expense form and their defaults (None = required)
+EXPENSE_AMOUNT_FIELDS = (('base_amount', None), ('discount_amount', 0),
+                         ('service_tax_amount', 0), ('gst_amount', 0))
+
+def parse_form_floats(form, fields):
+    """Parse several float form fields in one pass; None if any is missing or invalid"""
+    try:
+        values = [float(form[name] if default is None else form.get(name, default))
+                  for name, default in fields]
+    except (KeyError, ValueError):
+        return None
+    # float() accepts 'nan' and 'inf', which would slip past the range checks
+    return values if all(map(math.isfinite, values)) else None
 
 def calculate_total_amount(base_amount, discount_amount=0, service_tax_amount=0, gst_amount=0):
     """Calculate total amount with fixed discount, tax, and GST amounts"""
@@ -585,6 +1068,8 @@ def calculate_total_amount(base_amount, discount_amount=0, service_tax_amount=0,
         gst_amount = float(gst_amount)
         
         # Validate inputs
+        if not all(map(math.isfinite, (base_amount, discount_amount, service_tax_amount, gst_amount))):
+            return None
         if base_amount < 0 or discount_amount < 0 or service_tax_amount < 0 or gst_amount < 0:
             return None
         
@@ -609,49 +1094,147 @@ def calculate_total_amount(base_amount, discount_amount=0, service_tax_amount=0,
     except (ValueError, TypeError):
         return None
 
+def _to_cents(amount):
+    """Whole cents for a stored dollar amount"""
+    return int(round(amount * 100))
+
+def apply_expense_to_balances(balances, expense):
+    """Add one expense to a {member: cents} balance map in place"""
+    payer = expense.get('paid_by')
+    if payer in balances:
+        balances[payer] += _to_cents(expense.get('amount', 0))
+    for member, share in expense.get('shares', {}).items():
+        if member in balances:
+            balances[member] -= _to_cents(share)
+
+def calculate_balances(members, expenses):
+    """Net balance per member: what they paid minus their shares"""
+    # Accumulate into a flat list indexed by member position, so each
+    # payer/share costs one dict lookup instead of a test plus a read-modify-write.
+    # Sums are kept in integer cents so they are exact.
+    member_index = {member: i for i, member in enumerate(members)}
+    totals = [0] * len(members)
+    
+    for expense in expenses:
+        # The payer gets positive amount (they are owed money)
+        payer_idx = member_index.get(expense.get('paid_by'))
+        if payer_idx is not None:
+            totals[payer_idx] += _to_cents(expense.get('amount', 0))
+        
+        # Participants get negative amounts (they owe money)
+        for member, share in expense.get('shares', {}).items():
+            idx = member_index.get(member)
+            if idx is not None:
+                totals[idx] -= _to_cents(share)
+    
+    return {member: total / 100 for member, total in zip(members, totals)}
+
+# Above this many non-zero balances the 2^n subset search costs more than it saves
+_PARTITION_MAX_MEMBERS = 12
+
+def _zero_sum_partition(cents):
+    """Split positions of cents into the most disjoint zero-sum subsets.
+
+    best[mask] is the largest number of zero-sum prefixes reachable by
+    removing members from mask one at a time; walking the removals back
+    from the full set, each zero-sum prefix closes off one subset. A
+    subset of k members can then be settled in k-1 transfers.
+    """
+    n = len(cents)
+    full = (1 << n) - 1
+    subset_sum = [0] * (full + 1)
+    best = [0] * (full + 1)
+    drop = [0] * (full + 1)
+    
+    for mask in range(1, full + 1):
+        low_bit = mask & -mask
+        subset_sum[mask] = subset_sum[mask ^ low_bit] + cents[low_bit.bit_length() - 1]
+        
+        top, top_bit = -1, 0
+        remaining = mask
+        while remaining:
+            bit = remaining & -remaining
+            if best[mask ^ bit] > top:
+                top, top_bit = best[mask ^ bit], bit
+            remaining ^= bit
+        best[mask] = top + (subset_sum[mask] == 0)
+        drop[mask] = top_bit
+    
+    subsets = []
+    mask = boundary = full
+    while mask:
+        mask ^= drop[mask]
+        if subset_sum[mask] == 0:
+            closed = boundary ^ mask
+            subsets.append([i for i in range(n) if closed >> i & 1])
+            boundary = mask
+    return subsets
+
+def _settle_greedy(cents, indices):
+    """Settle the members at indices, largest creditor against largest debtor.
+
+    Works on member positions and cents only; returns
+    (from_index, to_index, amount_cents) triples.
+    """
+    # Max-heaps (amounts negated) so the largest creditor is always
+    # settled against the largest debtor in O(log n) per step
+    creditors = []
+    debtors = []
+    
+    # Separate creditors and debtors
+    for i in indices:
+        if cents[i] > 0:  # Creditors
+            creditors.append((-cents[i], i))
+        elif cents[i] < 0:  # Debtors
+            debtors.append((cents[i], i))
+    
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+    
+    transfers = []
+    
+    # Settle debts
+    while creditors and debtors:
+        neg_credit, creditor = heapq.heappop(creditors)
+        neg_debt, debtor = heapq.heappop(debtors)
+        credit_amt, debt_amt = -neg_credit, -neg_debt
+        
+        settlement_amt = min(credit_amt, debt_amt)
+        transfers.append((debtor, creditor, settlement_amt))
+        
+        # Push back whichever side still has an outstanding amount
+        if credit_amt != settlement_amt:
+            heapq.heappush(creditors, (settlement_amt - credit_amt, creditor))
+        if debt_amt != settlement_amt:
+            heapq.heappush(debtors, (settlement_amt - debt_amt, debtor))
+    
+    return transfers
+
 def simplify_debts(balances):
     """Simplify debts using minimum transactions"""
     try:
-        creditors = []
-        debtors = []
-        
-        # Separate creditors and debtors
-        for member, balance in balances.items():
-            if balance > 0.01:  # Creditors (using epsilon for float comparison)
-                creditors.append((member, balance))
-            elif balance < -0.01:  # Debtors
-                debtors.append((member, -balance))
+        # Work in whole cents so settled amounts are exact and need no epsilon
+        members = list(balances)
+        cents = [_to_cents(balances[member]) for member in members]
+        active = [i for i, amount in enumerate(cents) if amount != 0]
+        
+        # Settle each zero-sum subset on its own; larger groups fall back
+        # to a single greedy pass over everyone
+        if 1 < len(active) <= _PARTITION_MAX_MEMBERS:
+            subsets = [[active[j] for j in subset]
+                       for subset in _zero_sum_partition([cents[i] for i in active])]
+        else:
+            subsets = [active]
         
+        # Names are attached once, outside the settlement loop
         settlements = []
-        
-        # Sort by amount (largest first for better optimization)
-        creditors.sort(key=lambda x: x[1], reverse=True)
-        debtors.sort(key=lambda x: x[1], reverse=True)
-        
-        # Settle debts
-        while creditors and debtors:
-            creditor, credit_amt = creditors[0]
-            debtor, debt_amt = debtors[0]
-            
-            settlement_amt = min(credit_amt, debt_amt)
-            
-            settlements.append({
-                'from': debtor,
-                'to': creditor,
-                'amount': round(settlement_amt, 2)
-            })
-            
-            # Update amounts
-            if credit_amt > debt_amt:
-                creditors[0] = (creditor, credit_amt - debt_amt)
-                debtors.pop(0)
-            elif debt_amt > credit_amt:
-                debtors[0] = (debtor, debt_amt - credit_amt)
-                creditors.pop(0)
-            else:
-                creditors.pop(0)
-                debtors.pop(0)
-        
+        for subset in subsets:
+            for debtor, creditor, amount in _settle_greedy(cents, subset):
+                settlements.append({
+                    'from': members[debtor],
+                    'to': members[creditor],
+                    'amount': amount / 100
+                })
         return settlements
     except Exception:
         return []
@@ -664,7 +1247,7 @@ def initialize_app():
     load_data()
     load_users()
     start_email_worker()
-    print("✅ App initialized successfully")
+    logger.info("App initialized")
 
 # Call initialization
 initialize_app()
@@ -680,6 +1263,34 @@ def health_check():
     })
 
 
+def render_static_page(template_name, **context):
+    """render_template() for pages that depend only on their arguments.
+
+    Only for templates that show nothing from the session or flashes
+    (login.html); the output is rendered once per distinct context.
+    """
+    if app.jinja_env.auto_reload:
+        # Development: always pick up template edits
+        return render_template(template_name, **context)
+    key = (template_name, tuple(sorted(context.items())))
+    html = _PAGE_CACHE.get(key)
+    if html is None:
+        html = _PAGE_CACHE[key] = render_template(template_name, **context)
+    return html
+
+def login_required(view):
+    """Redirect to login unless signed in; exposes the session user on g"""
+    @functools.wraps(view)
+    def wrapped(*args, **kwargs):
+        user_id = session.get('user_id')
+        if not user_id:
+            return redirect(url_for('login'))
+        g.user_id = user_id
+        g.user_email = session.get('user_email')
+        g.user_name = session.get('user_name', 'Friend')
+        return view(*args, **kwargs)
+    return wrapped
+
 # Authentication Routes
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -690,8 +1301,22 @@ def login():
         
         users_data = load_users()
         user = users_data['users'].get(email)
-        
-        if user and verify_password(user['password'], password):
+        password_ok = verify_password(user['password'] if user else _DUMMY_PASSWORD_HASH, password)
+        
+        if user and password_ok:
+            if password_needs_rehash(user['password']):
+                # Upgrade older hashes while the plain password is at hand
+                users_data = load_users(for_update=True)
+                locked_user = users_data['users'].get(email)
+                # Skip if the account went away or its password changed since
+                # the unlocked read; the verified user is still fine to log in
+                if locked_user and locked_user['password'] == user['password']:
+                    locked_user['password'] = hash_password(password)
+                    if save_users(users_data):
+                        user = locked_user
+                    else:
+                        logger.warning("Could not save upgraded password hash for %s", user['id'])
+            
             if not user.get('verified', False):
                 flash('Please verify your email before logging in.', 'warning')
                 return redirect(url_for('login'))
@@ -711,7 +1336,7 @@ def login():
             flash('Invalid email or password.', 'error')
             return redirect(url_for('login'))
     
-    return render_template('login.html')
+    return render_static_page('login.html')
 
 @app.route('/register', methods=['POST'])
 def register():
@@ -721,31 +1346,29 @@ def register():
         password = request.form['password']
         confirm_password = request.form['confirm_password']
         
-        print(f"Registration attempt: {username}, {email}")
-        
         # Quick validation
         if not all([username, email, password]):
             flash('Please fill in all fields.', 'error')
-            return render_template('login.html', registration_error=True)
+            return render_static_page('login.html', registration_error=True)
         
         # Validate email format
         if not is_valid_email(email):
             flash('Please enter a valid email address.', 'error')
-            return render_template('login.html', registration_error=True)
+            return render_static_page('login.html', registration_error=True)
         
         if password != confirm_password:
             flash('Passwords do not match.', 'error')
-            return render_template('login.html', registration_error=True)
+            return render_static_page('login.html', registration_error=True)
         
         if len(password) < 6:
             flash('Password must be at least 6 characters long.', 'error')
-            return render_template('login.html', registration_error=True)
+            return render_static_page('login.html', registration_error=True)
         
-        users_data = load_users()
+        users_data = load_users(for_update=True)
         
         if email in users_data['users']:
             flash('Email already registered. Please login instead.', 'error')
-            return render_template('login.html', registration_error=True)
+            return render_static_page('login.html', registration_error=True)
         
         # Create user
         user_id = str(uuid.uuid4())
@@ -757,7 +1380,7 @@ def register():
             'email': email,
             'password': hash_password(password),
             'verified': False,  # REQUIRES EMAIL VERIFICATION
-            'verification_token': verification_token,
+            'verification_token': hash_token(verification_token),
             'created_at': datetime.now().isoformat(),
             'profile_visibility': 'private'
         }
@@ -779,24 +1402,20 @@ def register():
             return redirect(url_for('login'))
         else:
             flash('Error creating account. Please try again.', 'error')
-            return render_template('login.html', registration_error=True)
+            return render_static_page('login.html', registration_error=True)
     
     return redirect(url_for('login'))
 
 @app.route('/verify_email/<token>')
 def verify_email(token):
     """Verify email with the token"""
-    users_data = load_users()
-    user_found = False
+    users_data = load_users(for_update=True)
+    user = users_data['users'].get(users_data['_by_verification_token'].get(hash_token(token)))
     
-    for email, user in users_data['users'].items():
-        if user.get('verification_token') == token:
-            user['verified'] = True
-            user.pop('verification_token', None)
-            user_found = True
-            break
-    
-    if user_found:
+    if user:
+        user['verified'] = True
+        user.pop('verification_token', None)
+        
         if save_users(users_data):
             flash('Email verified successfully! You can now login.', 'success')
         else:
@@ -816,13 +1435,14 @@ def forgot_password():
             flash('Please enter a valid email address.', 'error')
             return redirect(url_for('login'))
         
-        users_data = load_users()
+        users_data = load_users(for_update=True)
         user = users_data['users'].get(email)
         
         if user and user.get('verified', False):
             reset_token = secrets.token_urlsafe(32)
-            user['reset_token'] = reset_token
-            user['reset_token_expiry'] = (datetime.now() + timedelta(hours=1)).isoformat()
+            user['reset_token'] = hash_token(reset_token)
+            # Epoch seconds: checking a link is one float compare, no parsing
+            user['reset_token_expiry'] = time.time() + 3600
             
             if save_users(users_data):
                 # Queue password reset email for background processing
@@ -844,18 +1464,18 @@ def forgot_password():
 
 @app.route('/reset_password/<token>', methods=['GET', 'POST'])
 def reset_password(token):
-    users_data = load_users()
+    users_data = load_users(for_update=request.method == 'POST')
     
     # Find user with valid reset token
-    user = None
-    user_email = None
-    for email, user_data in users_data['users'].items():
-        if (user_data.get('reset_token') == token and 
-            user_data.get('reset_token_expiry') and 
-            datetime.fromisoformat(user_data['reset_token_expiry']) > datetime.now()):
-            user = user_data
-            user_email = email
-            break
+    user_email = users_data['_by_reset_token'].get(hash_token(token))
+    user = users_data['users'].get(user_email)
+    if user:
+        expiry = user.get('reset_token_expiry')
+        if isinstance(expiry, str):
+            # Older files stored an ISO timestamp
+            expiry = _iso_to_ns(expiry) / 1e9
+        if not expiry or expiry <= time.time():
+            user = None
     
     if not user:
         flash('Invalid or expired reset link.', 'error')
@@ -893,46 +1513,46 @@ def logout():
 
 # Update index route to require login
 @app.route('/')
+@login_required
 def index():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
+    user_id = g.user_id
+    user_name = g.user_name
+    
+    # Serve the last render while data.json is unchanged
+    data_version = data_file_signature()
+    cached = _INDEX_CACHE.get(user_id)
+    use_cache = data_version is not None and '_flashes' not in session
+    if use_cache and cached and cached[0] == data_version and cached[1][0] == user_name:
+        return cached[1][1]
     
     try:
-        data = load_data()
+        data = get_data()
         groups = []
         
-        # Only show groups that belong to the current user or are shared with them
-        user_groups = []
-        for group_id, group in data.get('groups', {}).items():
-            if isinstance(group, dict):
-                # Check if user owns this group or has access
-                if group.get('owner_id') == session['user_id'] or session['user_id'] in group.get('shared_with', []):
-                    if 'id' not in group:
-                        group['id'] = int(group_id) if group_id.isdigit() else 0
-                    if 'members' not in group:
-                        group['members'] = []
-                    if 'created_at' not in group:
-                        group['created_at'] = datetime.now().isoformat()
-                    if 'expenses' not in group:
-                        group['expenses'] = []
-                    user_groups.append(group)
-        
-        # Sort groups by creation date (newest first)
-        user_groups.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        
-        # Calculate stats for homepage
+        # Only show groups that belong to the current user or are shared with
+        # them. Each user's bucket is kept in creation order, so walking it
+        # backwards lists the newest groups first without a sort; missing
+        # group fields were filled in when data.json was loaded
+        user_group_ids = data['_by_user'].get(user_id, [])
+        user_groups = [data['groups'][group_id] for group_id in reversed(user_group_ids)]
+        
+        # Calculate stats for homepage from the user's own groups, using the
+        # per-group counts and totals kept on write
         total_groups = len(user_groups)
-        total_expenses = len(data.get('expenses', {}))
-        total_spent = sum(expense.get('amount', 0) for expense in data.get('expenses', {}).values())
+        total_expenses = sum(len(data['_by_group'].get(group_id, ())) for group_id in user_group_ids)
+        total_spent = round(sum(group.get('total_spent', 0) for group in user_groups), 2)
         
-        return render_template('index.html', 
+        html = render_template('index.html', 
                              groups=user_groups, 
                              total_groups=total_groups,
                              total_expenses=total_expenses,
                              total_spent=total_spent,
-                             user_name=session.get('user_name', 'Friend'))
+                             user_name=user_name)
+        if use_cache:
+            _cache_store(_INDEX_CACHE, user_id, data_version, (user_name, html))
+        return html
     except Exception as e:
-        print(f"Error in index route: {e}")
+        logger.exception("Error in index route")
         flash('Error loading data. Please try again.', 'error')
         # Make sure we pass all required variables even in error case
         return render_template('index.html', 
@@ -940,17 +1560,15 @@ def index():
                              total_groups=0, 
                              total_expenses=0, 
                              total_spent=0, 
-                             user_name=session.get('user_name', 'Friend'))
+                             user_name=g.user_name)
 
 @app.route('/create_group', methods=['GET', 'POST'])
+@login_required
 def create_group():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     if request.method == 'POST':
         try:
             group_name = request.form['group_name'].strip()
-            member_names = [name.strip() for name in request.form['members'].split(',') if name.strip()]
+            member_names = _MEMBER_RE.findall(request.form['members'])
             
             if not group_name:
                 flash('Please enter a group name', 'error')
@@ -960,29 +1578,33 @@ def create_group():
                 flash('Please add at least 2 members', 'error')
                 return redirect(url_for('create_group'))
             
-            group_id = get_next_group_id()
-            if group_id is None:
-                flash('Error creating group. Please try again.', 'error')
-                return redirect(url_for('create_group'))
+            data = get_data(for_update=True)
             
-            data = load_data()
+            # Allocate the ID in the same load/save as the group itself
+            group_id = data['next_group_id']
+            data['next_group_id'] += 1
             
+            now_ns = time.time_ns()
             group = {
                 'id': group_id,
                 'name': group_name,
                 'members': member_names,
-                'owner_id': session['user_id'],
-                'owner_email': session['user_email'],
+                'balances': dict.fromkeys(member_names, 0),
+                'owner_id': g.user_id,
+                'owner_email': g.user_email,
                 'shared_with': [],
                 'share_token': secrets.token_urlsafe(16),
-                'created_at': datetime.now().isoformat(),
+                'created_at': datetime.fromtimestamp(now_ns / 1e9).isoformat(),
+                'created_at_ts': now_ns,
                 'expenses': []
             }
             
-            data['groups'][str(group_id)] = group
+            data['groups'][group_id] = group
+            data['_by_user'][g.user_id].append(group_id)
+            data['_by_share_token'][group['share_token']] = group_id
             
-            # Update recent members
-            update_recent_members(member_names)
+            # Update recent members; saved together with the group below
+            update_recent_members(data, member_names)
             
             if save_data(data):
                 flash(f'Group "{group_name}" created successfully!', 'success')
@@ -992,126 +1614,89 @@ def create_group():
                 return redirect(url_for('create_group'))
                 
         except Exception as e:
-            print(f"Error creating group: {e}")
+            logger.exception("Error creating group")
             flash(f'Error creating group: Please try again.', 'error')
             return redirect(url_for('create_group'))
     
     # Load recent members for suggestions
     try:
-        data = load_data()
+        data = get_data()
         recent_members = data.get('recent_members', [])
     except:
         recent_members = []
     
     return render_template('create_group.html', recent_members=recent_members)
 
-@app.route('/group/<int:group_id>')
-def group_detail(group_id):
+@app.route('/api/recent_members')
+def get_recent_members():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return jsonify({'error': 'Not logged in'}), 401
     
+    data = get_data()
+    etag = f"recent-members-{data['recent_members_version']}"
+    
+    # The list only changes when a group is created; skip the body when
+    # the browser already has this version
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(data['recent_members'])
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/group/<int:group_id>')
+@login_required
+def group_detail(group_id):
     try:
-        data = load_data()
-        group_key = str(group_id)
-        group = data['groups'].get(group_key)
+        data = get_data()
+        group = data['groups'].get(group_id)
         
         if not group:
             flash('Group not found', 'error')
             return redirect(url_for('index'))
         
         # Check if user has access to this group
-        if (group.get('owner_id') != session['user_id'] and 
-            session['user_id'] not in group.get('shared_with', [])):
+        if (group.get('owner_id') != g.user_id and 
+            g.user_id not in group.get('shared_with', [])):
             flash('You do not have access to this group.', 'error')
             return redirect(url_for('index'))
         
-        # Ensure group has all required fields
-        if 'id' not in group:
-            group['id'] = group_id
-        if 'members' not in group:
-            group['members'] = []
-        if 'expenses' not in group:
-            group['expenses'] = []
-        if 'created_at' not in group:
-            group['created_at'] = datetime.now().isoformat()
-        
-        # Get expenses for this group
-        group_expenses = []
-        
-        for exp_id in group.get('expenses', []):
-            # Try both string and integer keys
-            expense_key_str = str(exp_id)
-            expense_key_int = exp_id
-            
-            expense = None
-            if expense_key_str in data.get('expenses', {}):
-                expense = data['expenses'][expense_key_str]
-            elif isinstance(expense_key_int, int) and str(expense_key_int) in data.get('expenses', {}):
-                expense = data['expenses'][str(expense_key_int)]
-            
-            if expense and expense.get('group_id') == group_id:
-                try:
-                    # Ensure expense has all required fields with safe defaults
-                    if 'date' not in expense:
-                        expense['date'] = datetime.now().isoformat()
-                    if 'visit_date' not in expense:
-                        expense['visit_date'] = expense['date'][:10]
-                    if 'base_amount' not in expense:
-                        expense['base_amount'] = expense.get('amount', 0)
-                    if 'discount_amount' not in expense:
-                        expense['discount_amount'] = 0
-                    if 'service_tax_amount' not in expense:
-                        expense['service_tax_amount'] = 0
-                    if 'gst_amount' not in expense:
-                        expense['gst_amount'] = 0
-                    if 'participants' not in expense:
-                        expense['participants'] = group['members']
-                    
-                    # Safe date parsing
-                    try:
-                        expense['date_display'] = datetime.fromisoformat(expense['date']).strftime('%Y-%m-%d %H:%M')
-                    except (ValueError, TypeError):
-                        expense['date_display'] = "Unknown date"
-                    
-                    expense['visit_date_display'] = expense['visit_date'][:10]
-                    group_expenses.append(expense)
-                except (ValueError, KeyError) as e:
-                    print(f"Error processing expense {exp_id}: {e}")
-                    continue
+        # Get expenses for this group straight from the index; missing
+        # group and expense fields were filled in when data.json was loaded
+        group_expenses = [data['expenses'][exp_key] for exp_key in data['_by_group'].get(group_id, [])]
         
         # Sort expenses by date (newest first)
-        group_expenses.sort(key=lambda x: x.get('date', ''), reverse=True)
+        group_expenses.sort(key=itemgetter('date_ts'), reverse=True)
         
-        # Calculate total spent
-        total_spent = sum(expense.get('amount', 0) for expense in group_expenses)
+        # Kept up to date by add_expense
+        total_spent = group.get('total_spent', 0)
         
         return render_template('group_detail.html', 
                              group=group, 
                              expenses=group_expenses,
                              total_spent=total_spent,
-                             user_name=session.get('user_name'))
+                             user_name=g.user_name)
     except Exception as e:
-        print(f"Error in group_detail: {e}")
+        logger.exception("Error in group_detail")
         flash('Error loading group details. Please try again.', 'error')
         return redirect(url_for('index'))
 
 @app.route('/group/<int:group_id>/add_expense', methods=['GET', 'POST'])
+@login_required
 def add_expense(group_id):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     try:
-        data = load_data()
-        group_key = str(group_id)
-        group = data['groups'].get(group_key)
+        data = get_data(for_update=request.method == 'POST')
+        group = data['groups'].get(group_id)
         
         if not group:
             flash('Group not found', 'error')
             return redirect(url_for('index'))
         
         # Check if user has access to this group
-        if (group.get('owner_id') != session['user_id'] and 
-            session['user_id'] not in group.get('shared_with', [])):
+        if (group.get('owner_id') != g.user_id and 
+            g.user_id not in group.get('shared_with', [])):
             flash('You do not have access to this group.', 'error')
             return redirect(url_for('index'))
         
@@ -1119,15 +1704,12 @@ def add_expense(group_id):
             description = request.form['description'].strip()
             
             # Get tax calculation fields as FIXED AMOUNTS
-            try:
-                base_amount = float(request.form['base_amount'])
-                discount_amount = float(request.form.get('discount_amount', 0))
-                service_tax_amount = float(request.form.get('service_tax_amount', 0))
-                gst_amount = float(request.form.get('gst_amount', 0))
-                visit_date = request.form.get('visit_date', '')
-            except ValueError:
+            amounts = parse_form_floats(request.form, EXPENSE_AMOUNT_FIELDS)
+            if amounts is None:
                 flash('Please enter valid numbers for amounts', 'error')
                 return redirect(url_for('add_expense', group_id=group_id))
+            base_amount, discount_amount, service_tax_amount, gst_amount = amounts
+            visit_date = request.form.get('visit_date', '')
             
             paid_by = request.form['paid_by']
             split_type = request.form['split_type']
@@ -1150,13 +1732,15 @@ def add_expense(group_id):
             amount_after_discount = base_amount - discount_amount
             total_amount = amount_after_discount + service_tax_amount + gst_amount
             
-            # Get a new expense ID
-            expense_id = get_next_expense_id()
-            if expense_id is None:
-                flash('Error creating expense. Please try again.', 'error')
-                return redirect(url_for('add_expense', group_id=group_id))
+            total_cents = _to_cents(total_amount)
+            
+            # Allocate a new expense ID; persisted by the save below
+            expense_id = data['next_expense_id']
+            data['next_expense_id'] = expense_id + 1
             
             # Create the expense object with FIXED amounts
+            now_ns = time.time_ns()
+            now = datetime.fromtimestamp(now_ns / 1e9)
             expense = {
                 'id': expense_id,
                 'description': description,
@@ -1164,51 +1748,63 @@ def add_expense(group_id):
                 'discount_amount': discount_amount,
                 'service_tax_amount': service_tax_amount,
                 'gst_amount': gst_amount,
-                'amount': round(total_amount, 2),
+                'amount': total_cents / 100,
                 'paid_by': paid_by,
                 'group_id': group_id,
                 'split_type': split_type,
                 'visit_date': visit_date,
+                'visit_date_display': visit_date[:10],
                 'participants': participants,
-                'date': datetime.now().isoformat(),
+                'date': now.isoformat(),
+                'date_ts': now_ns,
+                'date_display': now.strftime('%Y-%m-%d %H:%M'),
                 'shares': {}
             }
             
-            # Calculate shares - ONLY for selected participants
+            # Calculate shares - ONLY for selected participants. Work in whole
+            # cents so the shares always add up to the total exactly
+            participants_set = set(participants)
             if split_type == 'equal':
-                share_amount = round(total_amount / len(participants), 2)
-                for member in group['members']:
-                    if member in participants:
-                        expense['shares'][member] = share_amount
-                    else:
-                        expense['shares'][member] = 0
+                # Position of each participant in member order
+                rank = {member: i for i, member in enumerate(
+                    member for member in group['members'] if member in participants_set)}
+                share_cents, leftover = divmod(total_cents, len(rank) or 1)
+                # The first participants each cover one of the leftover cents.
+                # Only participants get an entry; a missing member owes nothing
+                expense['shares'] = {
+                    member: (share_cents + (i < leftover)) / 100 for member, i in rank.items()
+                }
             else:
-                # Custom split - only for selected participants
-                total_custom = 0
-                for member in group['members']:
-                    if member in participants:
-                        share_amount = float(request.form.get(f'share_{member}', 0))
-                        expense['shares'][member] = share_amount
-                        total_custom += share_amount
-                    else:
-                        expense['shares'][member] = 0
+                # Custom split - only for selected participants; a blank share is 0
+                try:
+                    expense['shares'] = {
+                        member: float(request.form.get('share_' + member, 0) or 0)
+                        for member in group['members'] if member in participants_set
+                    }
+                except ValueError:
+                    expense['shares'] = None
+                # Same finiteness rule as parse_form_floats: 'nan'/'inf' parse as floats
+                if expense['shares'] is None or not all(map(math.isfinite, expense['shares'].values())):
+                    flash('Please enter valid numbers for custom shares', 'error')
+                    return redirect(url_for('add_expense', group_id=group_id))
+                custom_cents = sum(_to_cents(share) for share in expense['shares'].values())
                 
                 # Validate custom split totals
-                if abs(total_custom - total_amount) > 0.01:
-                    flash(f'Custom shares (${total_custom:.2f}) must equal total amount (${total_amount:.2f})', 'error')
+                if custom_cents != total_cents:
+                    flash(f'Custom shares (${custom_cents / 100:.2f}) must equal total amount (${total_cents / 100:.2f})', 'error')
                     return redirect(url_for('add_expense', group_id=group_id))
             
-            # Save the expense with string key
-            expense_key = str(expense_id)
-            data['expenses'][expense_key] = expense
+            # Save the expense under its int ID
+            data['expenses'][expense_id] = expense
+            data['_by_group'][group_id].append(expense_id)
             
-            # Add expense ID to group's expense list (ensure it's a list)
-            if 'expenses' not in group:
-                group['expenses'] = []
+            # Keep the group total in step so index() never re-sums
+            group['total_spent'] = round(group.get('total_spent', 0) + expense['amount'], 2)
+            apply_expense_to_balances(group['balances'], expense)
             
-            # Add the new expense ID if it doesn't exist
-            if expense_id not in group['expenses']:
-                group['expenses'].append(expense_id)
+            # Add the new expense ID to group's expense list; the ID was just
+            # allocated from next_expense_id, so it can't already be there
+            group['expenses'].append(expense_id)
             
             if save_data(data):
                 flash('Expense added successfully!', 'success')
@@ -1222,106 +1818,220 @@ def add_expense(group_id):
         return render_template('add_expense.html', group=group, today=today)
         
     except Exception as e:
-        print(f"Error in add_expense: {e}")
+        logger.exception("Error in add_expense")
         flash(f'Error: Please try again.', 'error')
         return redirect(url_for('group_detail', group_id=group_id))
 
 @app.route('/group/<int:group_id>/settle')
+@login_required
 def settle_up(group_id):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     try:
-        data = load_data()
-        group = data['groups'].get(str(group_id))
+        # Read the version before loading so a cached result is never newer than its key
+        data_version = data_file_signature()
+        data = get_data()
+        group = data['groups'].get(group_id)
         
         if not group:
             flash('Group not found', 'error')
             return redirect(url_for('index'))
         
-        # Ensure group has required fields
-        if 'members' not in group:
-            group['members'] = []
-        
-        # Calculate balances for each member
-        balances = {member: 0.0 for member in group['members']}
-        
-        # Get all expenses for this group
-        group_expenses = []
-        for exp_id in group.get('expenses', []):
-            expense = data.get('expenses', {}).get(str(exp_id))
-            if expense and expense.get('group_id') == group_id:
-                group_expenses.append(expense)
-        
-        # Calculate net balance for each member
-        for expense in group_expenses:
-            # The payer gets positive amount (they are owed money)
-            payer = expense.get('paid_by')
-            if payer in balances:
-                balances[payer] += expense.get('amount', 0)
-            
-            # Participants get negative amounts (they owe money)
-            for member, share in expense.get('shares', {}).items():
-                if member in balances:
-                    balances[member] -= share
+        # Same access rule as group_detail, checked before any cached result is used
+        if (group.get('owner_id') != g.user_id and 
+            g.user_id not in group.get('shared_with', [])):
+            flash('You do not have access to this group.', 'error')
+            return redirect(url_for('index'))
         
-        # Round balances to avoid floating point issues
-        balances = {member: round(balance, 2) for member, balance in balances.items()}
+        expense_keys = data['_by_group'].get(group_id, [])
         
-        # Simplify debts
-        settlements = simplify_debts(balances)
+        # Settlements only change when data.json does
+        cached = _SETTLE_CACHE.get(group_id)
+        if data_version is not None and cached and cached[0] == data_version:
+            balances, settlements = cached[1]
+        else:
+            # Net balances are kept up to date by add_expense, in cents
+            stored_balances = group.get('balances', {})
+            balances = {member: stored_balances.get(member, 0) / 100 for member in group['members']}
+            
+            # Simplify debts
+            settlements = simplify_debts(balances)
+            
+            if data_version is not None:
+                _cache_store(_SETTLE_CACHE, group_id, data_version, (balances, settlements))
         
         return render_template('settle_up.html', 
                              group=group, 
                              settlements=settlements, 
                              balances=balances,
-                             total_expenses=len(group_expenses))
+                             total_expenses=len(expense_keys))
     except Exception as e:
-        print(f"Error in settle_up: {e}")
+        logger.exception("Error in settle_up")
         flash('Error calculating settlements', 'error')
         return redirect(url_for('group_detail', group_id=group_id))
 
+@app.route('/group/<int:group_id>/download_csv')
+@login_required
+def download_csv(group_id):
+    try:
+        data = get_data()
+        group = data['groups'].get(group_id)
+        
+        if not group:
+            flash('Group not found', 'error')
+            return redirect(url_for('index'))
+        
+        # Check if user has access to this group
+        if (group.get('owner_id') != g.user_id and 
+            g.user_id not in group.get('shared_with', [])):
+            flash('You do not have access to this group.', 'error')
+            return redirect(url_for('index'))
+        
+        # Only this group's expenses, via the in-memory index
+        group_expenses = [data['expenses'][exp_key] for exp_key in data['_by_group'].get(group_id, [])]
+        group_expenses.sort(key=itemgetter('date_ts'), reverse=True)
+        
+        # Rows are built lazily, one expense at a time, as generate() pulls
+        # batches; the fields below are guaranteed by load normalization
+        money = '${:.2f}'.format
+        rows = (
+            (expense['date'][:10],
+             expense['visit_date_display'],
+             expense.get('description', ''),
+             expense.get('paid_by', ''),
+             money(expense['base_amount']),
+             money(expense['discount_amount']),
+             money(expense['service_tax_amount']),
+             money(expense['gst_amount']),
+             money(expense.get('amount', 0)),
+             expense.get('split_type', 'equal'),
+             ', '.join(expense['participants']))
+            for expense in group_expenses
+        )
+        
+        def generate():
+            # One reusable buffer: rows are written in batches with
+            # writerows, yielded and cleared, so the CSV text held at once
+            # is one batch (the sorted expense list itself is still O(N))
+            buffer = StringIO()
+            writer = csv.writer(buffer)
+            
+            def flush():
+                chunk = buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                return chunk
+            
+            writer.writerows([
+                ['SettleUp - Expense Report'],
+                [f"Group: {group['name']}"],
+                [f"Members: {', '.join(group.get('members', []))}"],
+                [],
+                ['Date', 'Visit Date', 'Description', 'Paid By', 'Base Amount', 'Discount',
+                 'Service Tax', 'GST', 'Total Amount', 'Split Type', 'Participants']
+            ])
+            yield flush()
+            
+            while True:
+                batch = list(islice(rows, CSV_BATCH_ROWS))
+                if not batch:
+                    break
+                writer.writerows(batch)
+                yield flush()
+            
+            writer.writerows([[], ['Total Spent', money(group.get('total_spent', 0))]])
+            yield flush()
+        
+        return Response(
+            generate(),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=group_{group_id}_expenses.csv'}
+        )
+    except Exception as e:
+        logger.exception("Error in download_csv")
+        flash('Error generating CSV', 'error')
+        return redirect(url_for('group_detail', group_id=group_id))
+
+@app.route('/group/<int:group_id>/delete', methods=['POST'])
+@login_required
+def delete_group(group_id):
+    try:
+        data = get_data(for_update=True)
+        group = data['groups'].get(group_id)
+
+        if not group:
+            flash('Group not found', 'error')
+            return redirect(url_for('index'))
+
+        # Check if user owns the group
+        if group.get('owner_id') != g.user_id:
+            flash('You can only delete groups you own.', 'error')
+            return redirect(url_for('group_detail', group_id=group_id))
+
+        # Only this group's bucket of the expense index is touched
+        for exp_key in data['_by_group'].pop(group_id, []):
+            data['expenses'].pop(exp_key, None)
+        for user_id in dict.fromkeys([group.get('owner_id')] + group.get('shared_with', [])):
+            data['_by_user'][user_id].remove(group_id)
+        data['_by_share_token'].pop(group.get('share_token'), None)
+        del data['groups'][group_id]
+        with _RENDER_CACHE_LOCK:
+            _SETTLE_CACHE.pop(group_id, None)
+
+        if save_data(data):
+            flash(f'Group "{group["name"]}" deleted.', 'success')
+        else:
+            flash('Error deleting group. Please try again.', 'error')
+        return redirect(url_for('index'))
+    except Exception as e:
+        logger.exception("Error deleting group")
+        flash('Error deleting group. Please try again.', 'error')
+        return redirect(url_for('index'))
+
+# Plain-text invite for the mailto: link; filled with the group name, link and sender
+SHARE_EMAIL_BODY_TEMPLATE = string.Template("""\
+Hi!
+
+I've created an expense sharing group "${group_name}" on Friendz Share and I'd like you to join.
+
+Click the link below to join the group:
+${link}
+
+With Friendz Share, we can easily track and split expenses together.
+
+Looking forward to sharing expenses with you!
+
+Best regards,
+${sender}
+""")
+
+@functools.lru_cache(maxsize=256)
+def group_share_texts(group_name, share_link):
+    """WhatsApp link and email subject for a group invite; fixed per group"""
+    # The text goes into a URL query, so it must be percent-encoded
+    whatsapp_text = f"Join my expense sharing group '{group_name}' on Friendz Share: {share_link}"
+    return (f"https://wa.me/?text={urllib.parse.quote(whatsapp_text)}",
+            f"Join my expense sharing group: {group_name}")
+
 @app.route('/group/<int:group_id>/share')
+@login_required
 def share_group(group_id):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     try:
-        data = load_data()
-        group = data['groups'].get(str(group_id))
+        data = get_data()
+        group = data['groups'].get(group_id)
         
         if not group:
             flash('Group not found', 'error')
             return redirect(url_for('index'))
         
         # Check if user owns the group
-        if group.get('owner_id') != session['user_id']:
+        if group.get('owner_id') != g.user_id:
             flash('You can only share groups you own.', 'error')
             return redirect(url_for('group_detail', group_id=group_id))
         
         share_link = f"{request.host_url}join_group/{group['share_token']}"
         
-        # Create WhatsApp share link
-        whatsapp_text = f"Join my expense sharing group '{group['name']}' on Friendz Share: {share_link}"
-        whatsapp_link = f"https://wa.me/?text={whatsapp_text}"
-        
-        # Create email share content
-        email_subject = f"Join my expense sharing group: {group['name']}"
-        email_body = f"""
-        Hi!
-
-        I've created an expense sharing group "{group['name']}" on Friendz Share and I'd like you to join.
-
-        Click the link below to join the group:
-        {share_link}
-
-        With Friendz Share, we can easily track and split expenses together.
-
-        Looking forward to sharing expenses with you!
-
-        Best regards,
-        {session['user_name']}
-        """
+        whatsapp_link, email_subject = group_share_texts(group['name'], share_link)
+        email_body = SHARE_EMAIL_BODY_TEMPLATE.substitute(
+            group_name=group['name'], link=share_link, sender=g.user_name)
         
         return render_template('share_group.html', 
                              group=group, 
@@ -1330,7 +2040,7 @@ def share_group(group_id):
                              email_subject=email_subject,
                              email_body=email_body)
     except Exception as e:
-        print(f"Error sharing group: {e}")
+        logger.exception("Error sharing group")
         flash('Error generating share link', 'error')
         return redirect(url_for('group_detail', group_id=group_id))
 
@@ -1341,14 +2051,11 @@ def join_group(token):
         return redirect(url_for('login'))
     
     try:
-        data = load_data()
+        data = get_data(for_update=True)
         
         # Find group with matching share token
-        target_group = None
-        for group_id, group in data['groups'].items():
-            if group.get('share_token') == token:
-                target_group = group
-                break
+        group_id = data['_by_share_token'].get(token)
+        target_group = data['groups'].get(group_id)
         
         if not target_group:
             flash('Invalid or expired share link.', 'error')
@@ -1365,6 +2072,9 @@ def join_group(token):
             target_group['shared_with'] = []
         
         target_group['shared_with'].append(session['user_id'])
+        # Slot it into the user's group list by creation time, as index() expects
+        bisect.insort(data['_by_user'][session['user_id']], group_id,
+                      key=lambda key: data['groups'][key].get('created_at_ts', 0))
         
         if save_data(data):
             flash(f'You have joined the group "{target_group["name"]}"!', 'success')
@@ -1374,12 +2084,12 @@ def join_group(token):
             return redirect(url_for('index'))
             
     except Exception as e:
-        print(f"Error joining group: {e}")
+        logger.exception("Error joining group")
         flash('Error joining group. Please try again.', 'error')
         return redirect(url_for('index'))
 
 # Debug route to check email configuration
-@app.route('/debug/email')
+@debug_route('/debug/email')
 def debug_email():
     email_config = {
         'MAIL_SERVER': app.config['MAIL_SERVER'],
@@ -1392,7 +2102,7 @@ def debug_email():
     return jsonify(email_config)
 
 # Debug route to check users (ONLY ONE VERSION)
-@app.route('/debug/users')
+@debug_route('/debug/users')
 def debug_users():
     """Show all users for debugging"""
     users_data = load_users()
@@ -1406,15 +2116,18 @@ def debug_users():
             'has_token': 'verification_token' in user
         })
     
-    return jsonify({
+    response = jsonify({
         'total_users': len(user_list),
         'users': user_list
     })
+    response.cache_control.private = True
+    response.cache_control.max_age = 5
+    return response
 
-@app.route('/auto_verify_all')
+@debug_route('/auto_verify_all')
 def auto_verify_all():
     """Auto-verify all existing users"""
-    users_data = load_users()
+    users_data = load_users(for_update=True)
     verified_count = 0
     
     for email, user in users_data['users'].items():